@@ -15,6 +15,9 @@ python buildcff2vf.py <path to designspace file> (<optional path to output
 __help__ = __usage__ + """
 Options:
 -p   Use 'post' table format 3.
+-w   Process the glyphs with one worker process per available CPU. This
+     is only supported on Linux; elsewhere the glyphs are processed
+     serially.
 
 The script makes a number of assumptions.
 1) all the master source fonts are blend compatible in all their data.
@@ -46,14 +49,15 @@ https://github.com/fonttools/fonttools
 import collections
 import io
 import logging
+import multiprocessing
 import os
 import sys
 
 from fontTools import varLib, version as fontToolsVersion
+from fontTools.misc.fixedTools import otRound
 from fontTools.misc.py23 import tobytes
 from fontTools.ttLib import TTFont, newTable
-from fontTools.cffLib import (VarStoreData, buildOpcodeDict,
-                              privateDictOperators)
+from fontTools.cffLib import VarStoreData, privateDictOperators
 from fontTools.misc.psCharStrings import T2OutlineExtractor, T2CharString
 from fontTools.pens.t2CharStringPen import T2CharStringPen
 from fontTools.ttLib.tables import otTables
@@ -70,6 +74,7 @@ xmlToString = ET.tostring
 kMaxStack = 48
 kTempCFFSuffix = ".temp.cff"
 kTempCFF2File = "test.cff2"
+kHintMaskOps = frozenset(('hintmask', 'cntrmask'))
 
 # setup basic logging to enable fontTools errors to peek thru
 logging.basicConfig()
@@ -111,7 +116,8 @@ class CFF2FontData(object):
         # for identifier in glyph-list:
         # Get charstring.
         self.topDict = topDict
-        self.isCID = hasattr(topDict, "FDArray")
+        self.fdArray = getattr(topDict, "FDArray", None)
+        self.isCID = self.fdArray is not None
         self.charStrings = topDict.CharStrings
         self.charStringIndex = self.charStrings.charStringsIndex
         self.allowDecimalCoords = False
@@ -197,29 +203,57 @@ class OpListPen(T2CharStringPen):
     def __init__(self, supportHints):
         super(OpListPen, self).__init__(0, {})
         self.opList = []
-        self.absMovetoPt = [0, 0]
+        self.absMovetoPt = (0, 0)
         self.supportHints = supportHints
 
+    def _p(self, pt):
+        # OpListPen always uses the default rounding tolerance of 0.5, and
+        # this ignores roundTolerance. At 0.5, roundPoint() always reduces
+        # to otRound(), so do that inline.
+        x0, y0 = self._p0
+        x, y = pt
+        x = otRound(x)
+        y = otRound(y)
+        self._p0 = (x, y)
+        return [x - x0, y - y0]
+
     def _moveTo(self, pt):
         self.opList.append(["rmoveto", self._p(pt)])
-        self.absMovetoPt = list(self._p0)
+        # _p0 is an immutable tuple, so it can be kept without copying.
+        self.absMovetoPt = self._p0
 
     def _lineTo(self, pt):
         self.opList.append(["rlineto", self._p(pt)])
 
     def _curveToOne(self, pt1, pt2, pt3):
-        _p = self._p
-        self.opList.append(["rrcurveto", _p(pt1) + _p(pt2) + _p(pt3)])
+        # Build the six args in one list, rather than concatenating the
+        # results of three _p() calls.
+        x0, y0 = self._p0
+        x1, y1 = pt1
+        x2, y2 = pt2
+        x3, y3 = pt3
+        x1 = otRound(x1)
+        y1 = otRound(y1)
+        x2 = otRound(x2)
+        y2 = otRound(y2)
+        x3 = otRound(x3)
+        y3 = otRound(y3)
+        self._p0 = (x3, y3)
+        self.opList.append(["rrcurveto", [x1 - x0, y1 - y0, x2 - x1,
+                                          y2 - y1, x3 - x2, y3 - y2]])
 
     def _closePath(self):
         # Add closing lineto if start and end path are not the same.
         # We need this to compatibilize different master designs where
         # the the last path op in one design is a rlineto and is omitted,
         # while the last path op in another is an rrcurveto.
-        if (self._p0[0] != self.absMovetoPt[0]) or (
-           self._p0[1] != self.absMovetoPt[1]):
-            self.opList.append(["rlineto", [self._p0[0] - self.absMovetoPt[0],
-                               self._p0[1] - self.absMovetoPt[1]]])
+        # Most paths are already closed: both points are tuples, so check
+        # that with a single comparison.
+        if self._p0 == self.absMovetoPt:
+            return
+        x, y = self._p0
+        startX, startY = self.absMovetoPt
+        self.opList.append(["rlineto", [x - startX, y - startY]])
 
     def vstem(self, args):
         if self.supportHints:
@@ -250,8 +284,8 @@ class OpListPen(T2CharStringPen):
 
 
 class CFF2GlyphData(object):
-    hintOpList = ('hintmask', 'cntrmask', 'hstem', 'vstem', 'hstemhm',
-                  'vstemhm')
+    hintOpSet = frozenset(('hintmask', 'cntrmask', 'hstem', 'vstem',
+                           'hstemhm', 'vstemhm'))
 
     def __init__(self, glyphName, gid, masterFontList):
         self.glyphName = glyphName
@@ -279,6 +313,21 @@ class CFF2GlyphData(object):
                     ptList[i] = [item]
         return opList
 
+    def removeHintOps(self, opList, curveOpIndexes):
+        # Rebuild the master font path without hint ops, rather than
+        # executing its charstring again with supportHints off. Only the
+        # master font value is kept for each arg, and lines that were
+        # padded into flat curves are turned back into lines.
+        newOpList = []
+        for opIndex, (op, ptList) in enumerate(opList):
+            if op in self.hintOpSet:
+                continue
+            if opIndex in curveOpIndexes:
+                op = 'rlineto'
+                ptList = ptList[2:-2]
+            newOpList.append([op, [[argList[0]] for argList in ptList]])
+        return newOpList
+
     def buildMMData(self):
         # Build MM charstring, and list of  points.
         # First, build a list of path entries for the default master.
@@ -292,6 +341,8 @@ class CFF2GlyphData(object):
         supportHints = True
         self.opList = opList = self.buildOpList(0, supportHints)
         numOps = len(opList)
+        # Indexes of the master font lines padded into flat curves.
+        curveOpIndexes = set()
         # For each other master in turn,
         #  add the args for each opName to pointList
         # deal with incompatible path lists because:
@@ -304,7 +355,7 @@ class CFF2GlyphData(object):
             opIndex = op2Index = 0
             while opIndex < numOps:
                 masterOp, masterPointList = opList[opIndex]
-                if (not supportHints) and masterOp in self.hintOpList:
+                if (not supportHints) and masterOp in self.hintOpSet:
                     opIndex += 1
                     continue
 
@@ -322,7 +373,7 @@ class CFF2GlyphData(object):
                     blendError = True
                     break
 
-                if (not supportHints) and token in self.hintOpList:
+                if (not supportHints) and token in self.hintOpSet:
                     op2Index += 1
                     continue
 
@@ -330,14 +381,18 @@ class CFF2GlyphData(object):
                     self.updateLineToCurve(pointList)
                 elif masterOp == 'rlineto' and token == 'rrcurveto':
                     self.updateLineToCurve(masterPointList)
-                    opList[opIndex] = ['rrcurveto', masterPointList]
+                    # masterPointList was padded in place; only the
+                    # op name changes.
+                    opList[opIndex][0] = 'rrcurveto'
+                    curveOpIndexes.add(opIndex)
                 elif token != masterOp:
-                    if supportHints and (masterOp in self.hintOpList or (
-                       token in self.hintOpList)):
+                    if supportHints and (masterOp in self.hintOpSet or (
+                       token in self.hintOpSet)):
                         # restart with hint support off.
                         supportHints = False
-                        self.opList = opList = self.buildOpList(
-                            0, supportHints)
+                        self.opList = opList = self.removeHintOps(
+                            opList, curveOpIndexes)
+                        curveOpIndexes = set()
                         numOps = len(opList)
                         i = 1
                         break
@@ -349,14 +404,15 @@ class CFF2GlyphData(object):
 
                 try:
                     self.mergePointList(masterPointList, pointList,
-                                        masterOp in ('hintmask', 'cntrmask'))
+                                        masterOp in kHintMaskOps)
                 except IndexError:
-                    if supportHints and masterOp in self.hintOpList or (
-                       token in self.hintOpList):
+                    if supportHints and masterOp in self.hintOpSet or (
+                       token in self.hintOpSet):
                         # restart with hint support off.
                         supportHints = False
-                        self.opList = opList = self.buildOpList(
-                            0, supportHints)
+                        self.opList = opList = self.removeHintOps(
+                            opList, curveOpIndexes)
+                        curveOpIndexes = set()
                         numOps = len(opList)
                         i = 1
                         break
@@ -374,29 +430,30 @@ class CFF2GlyphData(object):
         return blendError
 
     def mergePointList(self, masterPointList, pointList, isHintMask):
-        i = 0
-        while i < len(masterPointList):
-            if isHintMask:
-                # can't blend hint masks. Just use the first one.
-                masterPointList[i].append(masterPointList[i][0])
-            else:
-                masterPointList[i].append(pointList[i])
-            i += 1
+        if isHintMask:
+            # can't blend hint masks. Just use the first one.
+            for masterArgs in masterPointList:
+                masterArgs.append(masterArgs[0])
+            return
+        # The caller relies on an IndexError when this master has fewer
+        # args than the default master.
+        if len(pointList) < len(masterPointList):
+            raise IndexError("master has too few args")
+        for masterArgs, arg in zip(masterPointList, pointList):
+            masterArgs.append(arg)
 
     def updateLineToCurve(self, pointList):
         # pointList has a lineto that needs to be a flat curve.
         # Convert to curve by pre-pending [0,0], and appending [0,0]
+        # Insert both leading values with one slice assignment, so the
+        # list is only shifted once.
         if isinstance(pointList[0], list):
             numMasters = len(pointList[0])
-            pointList.insert(0, [0] * numMasters)
-            pointList.insert(0, [0] * numMasters)
-            pointList.append([0] * numMasters)
-            pointList.append([0] * numMasters)
+            pointList[:0] = [[0] * numMasters, [0] * numMasters]
+            pointList.extend(([0] * numMasters, [0] * numMasters))
         else:
-            pointList.insert(0, 0)
-            pointList.insert(0, 0)
-            pointList.append(0)
-            pointList.append(0)
+            pointList[:0] = [0, 0]
+            pointList.extend((0, 0))
 
 
 class AxisValueRecord(object):
@@ -436,7 +493,100 @@ def getInsertGID(origGID, fontGlyphNameList, mergedGlyphNameList):
     return None
 
 
-def buildMasterList(inputPaths):
+# The per-glyph function, glyph data, and variation model used by
+# mapGlyphData() worker processes. They are set only while a pool is
+# running, and are passed to the workers by fork inheritance, so that the
+# parsed master fonts do not have to be pickled for each task.
+_workerFunc = None
+_cff2GlyphList = None
+_varModel = None
+
+
+def getForkContext():
+    # Only fork-based workers can share the parsed fonts without pickling.
+    # Forking is limited to Linux: on macOS, forked children can crash in
+    # system libraries, which is why Python no longer forks there by
+    # default.
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return multiprocessing.get_context("fork")
+    except AttributeError:
+        # Python 2 always forks on Linux.
+        return multiprocessing
+    except ValueError:
+        return None
+
+
+def getNumCPUs():
+    # Unlike cpu_count(), the affinity mask reflects the CPUs this process
+    # may actually run on, including cpuset limits.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        pass
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def getNumWorkers(numGlyphs, useWorkers):
+    if not useWorkers:
+        return 1
+    # Daemonic processes, such as multiprocessing.Pool workers, are not
+    # allowed to have children.
+    if multiprocessing.current_process().daemon:
+        return 1
+    return min(getNumCPUs(), numGlyphs)
+
+
+def runWorkerFunc(glyphName):
+    return _workerFunc(_cff2GlyphList[glyphName], _varModel)
+
+
+def mapGlyphData(func, cff2GlyphList, fontGlyphList, varModel=None,
+                 useWorkers=False):
+    """Yield func(cff2GlyphData, varModel) for each glyph in fontGlyphList,
+    in order. If useWorkers is set, the glyphs are processed by a pool of
+    forked worker processes on Linux; otherwise the work is done
+    serially."""
+    global _workerFunc, _cff2GlyphList, _varModel
+    numGlyphs = len(fontGlyphList)
+    numWorkers = getNumWorkers(numGlyphs, useWorkers)
+    context = getForkContext() if numWorkers > 1 else None
+    if context is None:
+        for glyphName in fontGlyphList:
+            yield func(cff2GlyphList[glyphName], varModel)
+        return
+    # The workers are forked when the pool is created, so set these first.
+    _workerFunc = func
+    _cff2GlyphList = cff2GlyphList
+    _varModel = varModel
+    pool = None
+    try:
+        pool = context.Pool(numWorkers)
+        # Send the glyph names in batches to amortize the IPC cost.
+        chunkSize = max(1, numGlyphs // (numWorkers * 4))
+        for result in pool.imap(runWorkerFunc, fontGlyphList, chunkSize):
+            yield result
+        pool.close()
+        pool.join()
+        pool = None
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        _workerFunc = _cff2GlyphList = _varModel = None
+
+
+def buildGlyphMMData(cff2GlyphData, varModel):
+    # The variation model is not needed to merge the master designs.
+    blendError = cff2GlyphData.buildMMData()
+    return cff2GlyphData.glyphName, cff2GlyphData.opList, blendError
+
+
+def buildMasterList(inputPaths, useWorkers=False):
     blendError = False
     cff2FontList = []
     # Collect all the charstrings.
@@ -444,36 +594,36 @@ def buildMasterList(inputPaths):
     print("Opening default font", inputPaths[0])
     baseFont = openOpenTypeFile(inputPaths[0])
     cff2FontList.append(baseFont)
+    for fontPath in inputPaths[1:]:
+        print("Opening", fontPath)
+        cff2FontList.append(openOpenTypeFile(fontPath))
 
-    # Get the master source data for all the glyphs.
+    # Get the master source data for all the glyphs, in a single pass
+    # over the glyph list.
     fontGlyphList = baseFont.ttFont.getGlyphOrder()
+    baseGIDs = baseFont.charStrings.charStrings
+    masterCharStrings = [(masterFont.charStrings.charStrings,
+                          masterFont.charStringIndex)
+                         for masterFont in cff2FontList]
     for glyphName in fontGlyphList:
-        gid = baseFont.charStrings.charStrings[glyphName]
+        gid = baseGIDs[glyphName]
         cff2GlyphData = CFF2GlyphData(glyphName, gid, cff2FontList)
         cff2GlyphList[glyphName] = cff2GlyphData
-
-        t2CharString = baseFont.charStringIndex[gid]
-        cff2GlyphData.addCharString(t2CharString)
-
-    for fontPath in inputPaths[1:]:
-        print("Opening", fontPath)
-        masterFont = openOpenTypeFile(fontPath)
-        cff2FontList.append(masterFont)
-        for glyphName in fontGlyphList:
-            cff2GlyphData = cff2GlyphList[glyphName]
-            gid = masterFont.charStrings.charStrings[glyphName]
-            if gid != cff2GlyphData.gid:
+        for glyphGIDs, charStringIndex in masterCharStrings:
+            if glyphGIDs[glyphName] != gid:
                 raise ACFontError("GID in master font did not match GID in "
                                   "base font: %s." % glyphName)
-            t2CharString = masterFont.charStringIndex[gid]
+            t2CharString = charStringIndex[gid]
             cff2GlyphData.addCharString(t2CharString)
 
     # Now build MM versions.
     print("Reading glyph data...")
     blendError = False
-    for glyphName in fontGlyphList:
-        cff2GlyphData = cff2GlyphList[glyphName]
-        blendError = cff2GlyphData.buildMMData()
+    for glyphName, opList, blendError in mapGlyphData(
+            buildGlyphMMData, cff2GlyphList, fontGlyphList,
+            useWorkers=useWorkers):
+        # The MM data may have been built in a worker process.
+        cff2GlyphList[glyphName].opList = opList
         if blendError:
             break
     if blendError:
@@ -482,73 +632,66 @@ def buildMasterList(inputPaths):
 
     # Now get the MM data for the Private Dict.
     # Not all fonts will have the same keys.
-    # The first time a key is encountered, we fill out the
-    # value list for that key for all fonts, using the values from
-    # the first font which has the key. When other fonts with the
-    # key are encountered, the real values will overwrite the default values.
-    privateDictList = []
-    numMasters = len(cff2FontList)
-    curFont = cff2FontList[0]
-    isCID = curFont.isCID
-    if isCID:
-        numFDArray = len(cff2FontList[0].topDict.FDArray)
+    # The first time a key is encountered, we gather the values for that
+    # key from all the fonts at once. Fonts which do not have the key use
+    # the value from the first font which has the key.
+    # First, collect the masters' Private dicts for each FDArray index.
+    if baseFont.isCID:
+        fdArrayList = [curFont.fdArray for curFont in cff2FontList]
+        numFDArray = len(fdArrayList[0])
+        rawDictsByFD = [[fdArray[fdIndex].Private.rawDict
+                         for fdArray in fdArrayList]
+                        for fdIndex in range(numFDArray)]
     else:
-        numFDArray = 1
-    for fdIndex in range(numFDArray):
+        rawDictsByFD = [[curFont.topDict.Private.rawDict
+                         for curFont in cff2FontList]]
+    privateDictList = []
+    for fdIndex, rawDictList in enumerate(rawDictsByFD):
         blendedPD = {}
         privateDictList.append(blendedPD)
-        for master_index in range(numMasters):
-            curFont = cff2FontList[master_index]
-            if isCID:
-                pd = curFont.topDict.FDArray[fdIndex].Private
-            else:
-                pd = curFont.topDict.Private
-            for key, value in pd.rawDict.items():
-                try:
-                    valList = blendedPD[key]
-                    if isinstance(valList[0], list):
-                        lenValueList = len(value)
-                        if lenValueList != len(valList):
-                            print("Error: the number of items in the",
-                                  "value list for key", key,
-                                  "in the Private dict of FDDict index",
-                                  fdIndex, "in master font", master_index,
-                                  "is different than for previous masters.")
-                            print("Failed to blend master designs.")
-                            blendError = True
-                            return None, None, None, None, blendError
-                        for j in range(lenValueList):
-                            val = value[j]
-                            valList[j][master_index] = val
-                    else:
-                        blendedPD[key][master_index] = value
-                except KeyError:
-                    if isinstance(value, list):
-                        lenValueList = len(value)
-                        valList = [None] * lenValueList
-                        for j in range(lenValueList):
-                            vList = [value[j]] * numMasters
-                            valList[j] = vList
-                        blendedPD[key] = valList
-                    else:
-                        blendedPD[key] = [value] * numMasters
+        for rawDict in rawDictList:
+            for key, value in rawDict.items():
+                if key in blendedPD:
+                    continue
+                masterValues = [masterDict.get(key, value)
+                                for masterDict in rawDictList]
+                if not isinstance(value, list):
+                    blendedPD[key] = masterValues
+                    continue
+                lenValueList = len(value)
+                for master_index, masterValue in enumerate(masterValues):
+                    if len(masterValue) != lenValueList:
+                        print("Error: the number of items in the",
+                              "value list for key", key,
+                              "in the Private dict of FDDict index",
+                              fdIndex, "in master font", master_index,
+                              "is different than for previous masters.")
+                        print("Failed to blend master designs.")
+                        blendError = True
+                        return None, None, None, None, blendError
+                # Transpose to one list of master values per list item.
+                blendedPD[key] = [list(valList)
+                                  for valList in zip(*masterValues)]
 
     return baseFont, privateDictList, cff2GlyphList, fontGlyphList, blendError
 
 
 def pointsDiffer(pointList):
-    val = False
+    # Return as soon as a value differs, without copying the list.
     p0 = pointList[0]
-    for p in pointList[1:]:
+    for p in pointList:
         if p != p0:
-            val = True
-            break
-    return val
+            return True
+    return False
 
 
-def appendBlendOp(op, pointList, varModel):
-    blendStack = []
-    numBlends = len(pointList)
+def appendBlendOp(op, pointList, varModel, blendStack=None):
+    # Appends the CFF2 program for one op to blendStack, and returns it.
+    # Callers building a whole charstring pass in the program list, so
+    # that no intermediate list is made for each op.
+    if blendStack is None:
+        blendStack = []
+    append = blendStack.append
     # pointList is arranged as:
     # [
     #   [m0, m1..mn] # values for each master for arg 0
@@ -558,63 +701,66 @@ def appendBlendOp(op, pointList, varModel):
     # ]
     # The CFF2 blend operator expects first the series of args 0-numBlends
     # from the first master
-    blendList = []
-    if op in ('hintmask', 'cntrmask'):
-        blendStack.append(op)
-        blendStack.append(pointList[0][0])
+    if op in kHintMaskOps:
+        append(op)
+        append(pointList[0][0])
         return blendStack
+    extend = blendStack.extend
+    getDeltas = varModel.getDeltas
+    blendList = []
     for argEntry in pointList:
         masterArg = argEntry[0]
         if pointsDiffer(argEntry):
-            blendStack.append(masterArg)
+            append(masterArg)
             blendList.append(argEntry)
         else:
             if blendList:
                 for masterValues in blendList:
-                    deltas = varModel.getDeltas(masterValues)
-                    # First item in 'deltas' is the default master value;
-                    # for CFF2 data, that has already been written.
-                    blendStack.extend(deltas[1:])
-                numBlends = len(blendList)
-                blendStack.append(numBlends)
-                blendStack.append('blend')
+                    # The first delta is the default master value, which
+                    # has already been written.
+                    extend(getDeltas(masterValues)[1:])
+                append(len(blendList))
+                append('blend')
                 blendList = []
-            blendStack.append(masterArg)
+            append(masterArg)
     if blendList:
         for masterValues in blendList:
-            deltas = varModel.getDeltas(masterValues)
-            # First item in 'deltas' is the default master value;
-            # for CFF2 data, that has already been written.
-            blendStack.extend(deltas[1:])
-        numBlends = len(blendList)
-        blendStack.append(numBlends)
-        blendStack.append('blend')
-        blendList = []
-    blendStack.append(op)
+            # The first delta is the default master value, which has
+            # already been written.
+            extend(getDeltas(masterValues)[1:])
+        append(len(blendList))
+        append('blend')
+    append(op)
     return blendStack
 
 
-def buildMMCFFTables(baseFont, privateDictList, cff2GlyphList, varModel):
+def buildGlyphCharString(cff2GlyphData, varModel):
+    # Only the compiled bytecode is returned: it is all the CFF2 table
+    # needs, and it is much cheaper to send back from a worker process
+    # than the program list.
+    program = []
+    for op, pointList in cff2GlyphData.opList:
+        appendBlendOp(op, pointList, varModel, program)
+    t2CharString = T2CharString(program=program)
+    t2CharString.compile(isCFF2=True)
+    return cff2GlyphData.glyphName, t2CharString.bytecode
+
+
+def buildMMCFFTables(baseFont, privateDictList, cff2GlyphList, varModel,
+                     useWorkers=False):
 
     # Build the blended PrivateDicts.
-    opCodeDict = buildOpcodeDict(privateDictOperators)
-    blendedPD = privateDictList[0]
+    # The set of delta-type keys and the list of target dicts are the same
+    # for every FDArray entry, so work them out once.
+    deltaKeys = frozenset(entry[1] for entry in privateDictOperators
+                          if entry[2] == 'delta')
     if baseFont.isCID:
-        numFDArray = len(baseFont.topDict.FDArray)
+        pdList = list(baseFont.fdArray)
     else:
-        numFDArray = 1
-    for fdIndex in range(numFDArray):
-        if baseFont.isCID:
-            pd = baseFont.topDict.FDArray[fdIndex]
-            blendedPD = privateDictList[fdIndex]
-        else:
-            pd = baseFont.topDict.Private
-            blendedPD = privateDictList[0]
-
-        for key in blendedPD.keys():
-            argType = opCodeDict[key][1]
-            valList = blendedPD[key]
-            if argType == 'delta':
+        pdList = [baseFont.topDict.Private]
+    for pd, blendedPD in zip(pdList, privateDictList):
+        for key, valList in blendedPD.items():
+            if key in deltaKeys:
                 # If all masters are the same for each entry in the list, then
                 # save a non-blend version; else save the blend version
                 needsBlend = False
@@ -628,8 +774,8 @@ def buildMMCFFTables(baseFont, privateDictList, cff2GlyphList, varModel):
                     for blendList in valList:
                         # convert blend list from absolute values to relative
                         # values from the previous blend list.
-                        relBlendList = [(val - prevBlendList[i]) for i, val in
-                                        enumerate(blendList)]
+                        relBlendList = [val - prevVal for val, prevVal in
+                                        zip(blendList, prevBlendList)]
                         prevBlendList = blendList
                         deltas = varModel.getDeltas(relBlendList)
                         # For PrivateDict BlueValues, the default font
@@ -647,24 +793,27 @@ def buildMMCFFTables(baseFont, privateDictList, cff2GlyphList, varModel):
 
             pd.rawDict[key] = dataList
 
+    # CFF2 has no widths in the charstrings. The glyphs share their
+    # Private dicts, so clear the width defaults once per dict.
+    if baseFont.isCID:
+        privateList = [fontDict.Private for fontDict in baseFont.fdArray]
+    else:
+        privateList = [baseFont.topDict.Private]
+    for private in privateList:
+        private.defaultWidthX = 0
+        private.nominalWidthX = 0
+
     # Now update all the charstrings.
     fontGlyphList = baseFont.ttFont.getGlyphOrder()
-    for glyphName in fontGlyphList:
-        gid = baseFont.charStrings.charStrings[glyphName]
-        t2CharString = baseFont.charStringIndex[gid]
-        cff2GlyphData = cff2GlyphList[glyphName]
-        t2CharString.decompile()
-        newProgram = []
-        for op, pointList in cff2GlyphData.opList:
-            blendStack = appendBlendOp(op, pointList, varModel)
-            newProgram.extend(blendStack)
-        t2CharString = T2CharString(private=t2CharString.private,
-                                    globalSubrs=t2CharString.globalSubrs)
-        baseFont.charStringIndex[gid] = t2CharString
-        t2CharString.program = newProgram
-        t2CharString.private.defaultWidthX = 0
-        t2CharString.private.nominalWidthX = 0
-        t2CharString.compile(isCFF2=True)
+    charStringIndex = baseFont.charStringIndex
+    for glyphName, bytecode in mapGlyphData(
+            buildGlyphCharString, cff2GlyphList, fontGlyphList, varModel,
+            useWorkers):
+        gid = cff2GlyphList[glyphName].gid
+        t2CharString = charStringIndex[gid]
+        charStringIndex[gid] = T2CharString(
+            bytecode=bytecode, private=t2CharString.private,
+            globalSubrs=t2CharString.globalSubrs)
 
 
 def addCFFVarStore(baseFont, varModel, varFont):
@@ -700,7 +849,8 @@ def convertCFFtoCFF2(baseFont, masterFont, post_format_3=False):
     cffTable.cff.convertCFFToCFF2(masterFont)
     newCFF2 = newTable("CFF2")
     newCFF2.cff = cffTable.cff
-    newCFF2.compile(masterFont)
+    # The table is compiled when the font is saved; compiling it here too
+    # would only serialize every charstring and subroutine twice.
     masterFont['CFF2'] = newCFF2
     if post_format_3:
         masterFont['post'].formatType = 3.0
@@ -930,7 +1080,7 @@ def addSTATTable(varFont, varFontPath):
 
 
 def buildCFF2Font(varFontPath, varFont, varModel, masterPaths,
-                  post_format_3=False):
+                  post_format_3=False, useWorkers=False):
     """Build CFF2 font from the master designs. default font is first."""
     numMasters = len(masterPaths)
     inputPaths = reorderMasters(varModel.mapping, masterPaths)
@@ -938,10 +1088,11 @@ def buildCFF2Font(varFontPath, varFont, varModel, masterPaths,
     # Since we have re-ordered the master master data to be the same
     # as the varModel.location order, the mappings are flat.
     (baseFont, privateDictList, cff2GlyphList, fontGlyphList, blendError) = \
-        buildMasterList(inputPaths)
+        buildMasterList(inputPaths, useWorkers)
     if blendError:
         return blendError
-    buildMMCFFTables(baseFont, privateDictList, cff2GlyphList, varModel)
+    buildMMCFFTables(baseFont, privateDictList, cff2GlyphList, varModel,
+                     useWorkers)
     addCFFVarStore(baseFont, varModel, varFont)
     addNamesToPost(varFont, fontGlyphList)
     convertCFFtoCFF2(baseFont, varFont, post_format_3)
@@ -957,6 +1108,7 @@ def otfFinder(s):
 
 def run(args=None):
     post_format_3 = False
+    useWorkers = False
     if not args:
         args = sys.argv[1:]
     if '-u' in args:
@@ -968,6 +1120,9 @@ def run(args=None):
     if '-p' in args:
         post_format_3 = True
         args.remove('-p')
+    if '-w' in args:
+        useWorkers = True
+        args.remove('-w')
 
     if parse_version(fontToolsVersion) < parse_version("3.19"):
         print("Quitting. The Python fonttools module must be at least 3.19.0 "
@@ -989,7 +1144,7 @@ def run(args=None):
                                                   otfFinder, exclude=("CFF2",))
 
     blendError = buildCFF2Font(varFontPath, varFont, varModel, masterPaths,
-                               post_format_3)
+                               post_format_3, useWorkers)
     if not blendError:
         print("Built variable font '%s'" % (varFontPath))
 
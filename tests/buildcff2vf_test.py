@@ -1,9 +1,13 @@
 from __future__ import print_function, division, absolute_import
 
 import os
+import pytest
 from shutil import copytree
+import sys
 import tempfile
 
+from afdko import buildcff2vf
+
 from runner import main as runner
 from differ import main as differ
 from test_utils import get_input_path, get_expected_path, generate_ttx_dump
@@ -12,18 +16,117 @@ TOOL = 'buildcff2vf'
 CMD = ['-t', TOOL]
 
 
-# -----
-# Tests
-# -----
+class Object(object):
+    pass
 
-def test_cjk_vf():
+
+def _get_cjk_vf_ds_path():
     input_dir = get_input_path('CJKVar')
     temp_dir = os.path.join(tempfile.mkdtemp(), 'CJKVar')
     copytree(input_dir, temp_dir)
-    ds_path = os.path.join(temp_dir, 'CJKVar.designspace')
-    runner(CMD + ['-o', 'p', '_{}'.format(ds_path)])
-    actual_path = os.path.join(temp_dir, 'CJKVar.otf')
+    return os.path.join(temp_dir, 'CJKVar.designspace')
+
+
+def _get_proofpdf_input_path(file_name):
+    # The proofpdf test fonts include masters with incompatible hints.
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'proofpdf_data', 'input', file_name)
+
+
+def _get_glyph_data(glyph_name, master_fonts):
+    glyph_data = buildcff2vf.CFF2GlyphData(glyph_name, 0, master_fonts)
+    for font in master_fonts:
+        gid = font.charStrings.charStrings[glyph_name]
+        glyph_data.addCharString(font.charStringIndex[gid])
+    return glyph_data
+
+
+def _check_cjk_vf_output(ds_path):
+    actual_path = os.path.join(os.path.dirname(ds_path), 'CJKVar.otf')
     actual_ttx = generate_ttx_dump(actual_path,
                                    ['CFF2', 'HVAR', 'avar', 'fvar'])
     expected_ttx = get_expected_path('CJKVar.ttx')
     assert differ([expected_ttx, actual_ttx, '-s', '<ttFont sfntVersion'])
+
+
+# -----
+# Tests
+# -----
+
+def test_cjk_vf():
+    ds_path = _get_cjk_vf_ds_path()
+    runner(CMD + ['-o', 'p', '_{}'.format(ds_path)])
+    _check_cjk_vf_output(ds_path)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason="worker processes are only used on Linux")
+def test_cjk_vf_worker_processes(monkeypatch):
+    monkeypatch.setattr(buildcff2vf, 'getNumCPUs', lambda: 2)
+    fork_contexts = []
+    get_fork_context = buildcff2vf.getForkContext
+
+    def spy_get_fork_context():
+        context = get_fork_context()
+        fork_contexts.append(context)
+        return context
+
+    monkeypatch.setattr(buildcff2vf, 'getForkContext', spy_get_fork_context)
+    ds_path = _get_cjk_vf_ds_path()
+    buildcff2vf.run(['-p', '-w', ds_path])
+    # One pool for the MM data, and one for the charstrings.
+    assert len(fork_contexts) == 2
+    assert None not in fork_contexts
+    _check_cjk_vf_output(ds_path)
+
+
+@pytest.mark.parametrize('use_workers, daemon, num_workers', [
+    (False, False, 1),
+    (True, False, 2),
+    (True, True, 1),
+])
+def test_get_num_workers(monkeypatch, use_workers, daemon, num_workers):
+    process = Object()
+    process.daemon = daemon
+    monkeypatch.setattr(buildcff2vf, 'getNumCPUs', lambda: 2)
+    monkeypatch.setattr(buildcff2vf.multiprocessing, 'current_process',
+                        lambda: process)
+    assert buildcff2vf.getNumWorkers(56, use_workers) == num_workers
+
+
+@pytest.mark.parametrize('font_names, glyph_names', [
+    (['font.otf', 'font_noHints.otf'], None),
+    # These glyphs have a line padded into a curve before the restart.
+    (['SourceSansPro-Black.otf', 'SourceSansPro-BlackIt.otf'],
+     ['t', 'u', 't.sups']),
+    (['SourceSansPro-BlackIt.otf', 'SourceSansPro-Black.otf'], ['Euro']),
+])
+def test_mm_data_hint_restart(capsys, font_names, glyph_names):
+    master_fonts = [buildcff2vf.openOpenTypeFile(
+        _get_proofpdf_input_path(font_name)) for font_name in font_names]
+    if glyph_names is None:
+        glyph_names = master_fonts[0].ttFont.getGlyphOrder()
+    padded_curves = []
+    for glyph_name in glyph_names:
+        glyph_data = _get_glyph_data(glyph_name, master_fonts)
+        remove_hint_ops = glyph_data.removeHintOps
+
+        def spy_remove_hint_ops(op_list, curve_op_indexes,
+                                remove_hint_ops=remove_hint_ops):
+            padded_curves.append(len(curve_op_indexes))
+            return remove_hint_ops(op_list, curve_op_indexes)
+
+        glyph_data.removeHintOps = spy_remove_hint_ops
+        # On restart, the expected data extracts the default master again
+        # with hint support off.
+        expected_data = _get_glyph_data(glyph_name, master_fonts)
+        expected_data.removeHintOps = (
+            lambda op_list, curve_op_indexes, expected_data=expected_data:
+            expected_data.buildOpList(0, False))
+        assert not glyph_data.buildMMData()
+        assert not expected_data.buildMMData()
+        assert glyph_data.opList == expected_data.opList
+    assert len(padded_curves) == len(glyph_names)
+    if font_names[0].startswith('SourceSansPro'):
+        assert all(padded_curves)
+    assert 'skipped incompatible hint data' in capsys.readouterr().out